@@ -1,14 +1,43 @@
 import os
+import logging
+import logging.handlers
+import queue
+import sys
+import functools
+import threading
+from collections import Counter, OrderedDict, defaultdict
 import google.generativeai as genai
-import pypdf
-import docx
-import io
-import json
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    # Fall back to the pure-Python parser when the pdfium wheel is unavailable
+    pdfium = None
+    import pypdf
+import tempfile
+import orjson
+import hashlib
+import html
+import urllib.parse
 import httpx
 import asyncio
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from typing import BinaryIO
+from telegram import Update, constants
+from telegram.constants import ParseMode
+from telegram.ext import (
+    AIORateLimiter,
+    Application,
+    ApplicationHandlerStop,
+    CommandHandler,
+    ContextTypes,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
+from cache import RedisStore, SemanticCache, SQLiteStore, exact_cache
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -18,130 +47,552 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ATS_API_BASE_URL = os.getenv("ATS_API_BASE_URL")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Ensure all required environment variables are set
-if not all([TELEGRAM_BOT_TOKEN, ATS_API_BASE_URL, GEMINI_API_KEY]):
-    raise ValueError("One or more required environment variables are missing.")
+# Optional webhook settings; without a public URL the bot falls back to polling.
+# A webhook also requires a secret so forged POSTs to the public endpoint are rejected.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_PATH = "telegram_webhook"
+
+# Ensure all required environment variables are set, reporting every missing one at once
+_required_settings = {
+    "TELEGRAM_BOT_TOKEN": TELEGRAM_BOT_TOKEN,
+    "ATS_API_BASE_URL": ATS_API_BASE_URL,
+    "GEMINI_API_KEY": GEMINI_API_KEY,
+}
+if TELEGRAM_WEBHOOK_URL:
+    _required_settings["TELEGRAM_WEBHOOK_SECRET"] = TELEGRAM_WEBHOOK_SECRET
+_missing_settings = [name for name, value in _required_settings.items() if not value]
+if _missing_settings:
+    raise ValueError(f"Missing required environment variables: {', '.join(_missing_settings)}")
+if not ATS_API_BASE_URL.startswith(("http://", "https://")):
+    raise ValueError("ATS_API_BASE_URL must be an http(s) URL.")
 
 # Configure the Gemini API
 genai.configure(api_key=GEMINI_API_KEY)
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Shape Gemini is constrained to when extracting details. An explicit proto schema
+# (rather than a TypedDict) lets every key be marked required.
+DETAIL_PROPERTIES = {
+    "skills": genai.protos.Schema(type_=genai.protos.Type.STRING),
+    "experience": genai.protos.Schema(type_=genai.protos.Type.INTEGER),
+    "location": genai.protos.Schema(type_=genai.protos.Type.STRING),
+}
+EXTRACTED_DETAILS_SCHEMA = genai.protos.Schema(
+    type_=genai.protos.Type.OBJECT,
+    properties=DETAIL_PROPERTIES,
+    required=list(DETAIL_PROPERTIES),
+)
+
+# Batched replies echo each input's id so results can be matched back to their text
+BATCH_ITEM_SCHEMA = genai.protos.Schema(
+    type_=genai.protos.Type.OBJECT,
+    properties={"id": genai.protos.Schema(type_=genai.protos.Type.INTEGER), **DETAIL_PROPERTIES},
+    required=["id", *DETAIL_PROPERTIES],
+)
+
+# Schema-constrained JSON output: no fences to strip, no malformed replies
+GEMINI_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": EXTRACTED_DETAILS_SCHEMA,
+    "max_output_tokens": 128,
+    "temperature": 0.0,
+}
+
+# Kept byte-identical across calls so Gemini's implicit prefix cache can reuse it
+GEMINI_INSTRUCTIONS = """Analyze the text you are given and extract the key details.
+Return a JSON object with "skills", "experience" and "location".
+- "skills": A comma-separated string of the top 5-7 most important technical skills.
+- "experience": An integer for total years of experience (default to 3 if not found).
+- "location": The city the candidate or role is based in, lowercase (default to "any" if not found).
+When given a JSON array of {"id", "text"} items instead, extract each "text" on its own and return
+a JSON array with one such object per item, each also carrying that item's "id" unchanged."""
+
+GEMINI_MODEL = genai.GenerativeModel(
+    'gemini-1.5-flash-latest',
+    generation_config=GEMINI_GENERATION_CONFIG,
+    system_instruction=GEMINI_INSTRUCTIONS,
+)
+GEMINI_BATCH_MODEL = genai.GenerativeModel(
+    'gemini-1.5-flash-latest',
+    generation_config={
+        **GEMINI_GENERATION_CONFIG,
+        "response_schema": genai.protos.Schema(type_=genai.protos.Type.ARRAY, items=BATCH_ITEM_SCHEMA),
+    },
+    system_instruction=GEMINI_INSTRUCTIONS,
+)
+
+# Concurrent extraction misses arriving within this window share one Gemini call
+GEMINI_BATCH_WINDOW = 0.05
+GEMINI_BATCH_SIZE = 8
+
+# Near-duplicate resumes/JDs above this cosine similarity reuse a cached extraction.
+# Each exact-cache miss makes one text-embedding call first, so a true miss pays
+# that extra round trip on top of the Gemini generation call.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# Lifetimes for exact-match caches (seconds); ATS results go stale much sooner
+GEMINI_CACHE_TTL = 24 * 3600
+ATS_CACHE_TTL = 10 * 60
+
+# Exact-match cache backend: "memory" (per process), "sqlite" or "redis" (shared)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+if CACHE_BACKEND == "sqlite":
+    CACHE_STORE = SQLiteStore(os.getenv("CACHE_SQLITE_PATH", "cache.sqlite3"))
+elif CACHE_BACKEND == "redis":
+    CACHE_STORE = RedisStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+else:
+    CACHE_STORE = None
+
+# Set when the ATS endpoint accepts a comma-separated skill list and returns the union
+ATS_BATCH_SKILLS = os.getenv("ATS_BATCH_SKILLS", "").lower() in ("1", "true", "yes")
+
+# Per-query deadline (seconds) for the ATS fan-out; late skills are dropped. Kept
+# above the client's 2 s connect timeout so a cold connection can still complete.
+ATS_FANOUT_TIMEOUT = float(os.getenv("ATS_FANOUT_TIMEOUT", "5.0"))
+
+# Reply card shown for each matched candidate (HTML; values are escaped on render)
+CANDIDATE_CARD_TEMPLATE = (
+    "👤 <b>Name:</b> {name}\n"
+    "📧 <b>Email:</b> {email}\n"
+    "📍 <b>Location:</b> {location}\n"
+    "💼 <b>Experience:</b> {experience} years\n"
+    "✨ <b>Match Score:</b> {score}"
+)
+RESUME_LINK_TEMPLATE = '\n📄 <a href="{url}">Download Resume</a>'
+
+# Candidate cards are sent together, split only at Telegram's message length cap
+CANDIDATE_SEPARATOR = "\n\n━━━\n\n"
+MAX_MESSAGE_LENGTH = constants.MessageLimit.MAX_TEXT_LENGTH
+
+# Accepted resume uploads
+ALLOWED_EXTENSIONS = ('.pdf', '.docx')
+ALLOWED_MIME_TYPES = frozenset({
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+})
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# Uploaded documents larger than this are buffered on disk rather than in memory
+SPOOL_MAX_MEMORY = 2 * 1024 * 1024
+
+# Pooled keep-alive connections for Bot API calls (replies, edits, file downloads)
+TELEGRAM_POOL_SIZE = 64
+
+# Bounded pipeline for Gemini + ATS work: at most K jobs run at once. Gemini
+# calls are still coalesced across jobs by the GeminiBatcher.
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "32"))
+PIPELINE_QUEUE_SIZE = 1000
+
+# How long shutdown waits (seconds) for queued and running jobs to finish
+PIPELINE_DRAIN_TIMEOUT = 30.0
+
+# Job queue and its workers, created on bot startup (see main)
+_pipeline_queue: asyncio.Queue | None = None
+_pipeline_workers: list[asyncio.Task] = []
+
+# Recently seen update ids, so Telegram's retries of an update are processed once
+SEEN_UPDATES_MAX = 10_000
+_seen_update_ids: OrderedDict[int, None] = OrderedDict()
+
+# PDFium is not thread-safe, even across documents: every pdfium call made from
+# a worker thread must hold this lock
+_pdfium_lock = threading.Lock()
+
+# Shared HTTP client for ATS calls, created on bot startup (see main)
+_http_client: httpx.AsyncClient | None = None
 
 # --- Helper Functions ---
-def extract_text_from_file(file_path: str, file_content: bytes) -> str:
-    """Extracts text from PDF or DOCX files."""
-    text = ""
+def configure_logging() -> logging.handlers.QueueListener:
+    """Routes log records through a queue so stderr writes happen off the event loop."""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    # httpx logs every request at INFO, which would include each Bot API call
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared, connection-pooled ATS client."""
+    if _http_client is None:
+        raise RuntimeError("HTTP client is not initialized; start the bot via main().")
+    return _http_client
+
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """PTB request backend that decodes Bot API responses with orjson."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Let PTB's lenient decoder handle (or report) malformed payloads
+            return HTTPXRequest.parse_json_payload(payload)
+
+async def open_http_client(application: Application) -> None:
+    """Creates the shared HTTP/2 client with keep-alive pooling."""
+    global _http_client
+    # HTTP/2 and pool limits live on the transport; httpx ignores the
+    # client-level equivalents once a transport is supplied. No connect retries:
+    # they could not finish inside the ATS fan-out deadline anyway.
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+    )
+    _http_client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(10.0, connect=2.0))
+
+async def close_http_client(application: Application) -> None:
+    """Closes the shared HTTP client and its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def extract_text_from_file(file_path: str, file_obj: BinaryIO) -> str:
+    """Extracts text from a PDF or DOCX file-like object."""
     try:
-        if file_path.lower().endswith('.pdf'):
-            with io.BytesIO(file_content) as f:
-                reader = pypdf.PdfReader(f)
-                for page in reader.pages:
-                    text += page.extract_text() or ""
+        if file_path.lower().endswith('.pdf') and pdfium is not None:
+            with _pdfium_lock:
+                pdf = pdfium.PdfDocument(file_obj)
+                try:
+                    parts = [page.get_textpage().get_text_range() for page in pdf]
+                finally:
+                    pdf.close()
+            return "".join(parts)
+        elif file_path.lower().endswith('.pdf'):
+            reader = pypdf.PdfReader(file_obj)
+            return "".join(text for page in reader.pages if (text := page.extract_text()))
         elif file_path.lower().endswith('.docx'):
-            with io.BytesIO(file_content) as f:
-                doc = docx.Document(f)
-                for para in doc.paragraphs:
-                    text += para.text + "\n"
+            # Imported on first use: python-docx pulls in lxml, which PDF-only
+            # traffic never needs
+            import docx
+            doc = docx.Document(file_obj)
+            return "\n".join(para.text for para in doc.paragraphs)
         else:
             return None
-    except Exception as e:
-        print(f"Error extracting text: {e}")
+    except Exception:
+        logger.exception("Error extracting text")
         return None
-    return text
 
-def local_match_skill(candidate_skills_str: str, requested_skills_str: str) -> int:
-    """A local version of the skill matcher to re-rank candidates."""
-    if not candidate_skills_str or not requested_skills_str:
-        return 0
-    candidate_skills = {s.lower().strip() for s in candidate_skills_str.split(',')}
-    requested_skills = {s.lower().strip() for s in requested_skills_str.split(',')}
-    return len(candidate_skills.intersection(requested_skills))
+@functools.lru_cache(maxsize=4096)
+def normalize_skills(skills_str: str) -> frozenset:
+    """Splits a comma-separated skills string into a set of normalized skills."""
+    return frozenset(sys.intern(s.lower().strip()) for s in skills_str.split(',') if s.strip())
+
+def score_candidates(candidates: dict, requested_set: frozenset) -> Counter:
+    """Counts requested-skill matches per candidate email via an inverted index."""
+    postings: defaultdict[str, set] = defaultdict(set)
+    for email, cand in candidates.items():
+        if cand.get('skills'):
+            for skill in normalize_skills(cand['skills']):
+                postings[skill].add(email)
+    scores = Counter()
+    for skill in requested_set:
+        scores.update(postings.get(skill, ()))
+    return scores
 
+async def embed_text(text_content: str) -> list | None:
+    """Uses Gemini to embed text for similarity lookups."""
+    try:
+        result = await genai.embed_content_async(
+            model=EMBEDDING_MODEL, content=text_content, task_type="semantic_similarity"
+        )
+        return result["embedding"]
+    except Exception:
+        logger.exception("Error calling Gemini embedding API")
+        return None
+
+def gemini_cache_key(text_content: str) -> str:
+    """Hashes the case- and whitespace-normalized text for the extraction cache."""
+    normalized = " ".join((text_content or "").split()).lower()
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+@exact_cache(gemini_cache_key, ttl=GEMINI_CACHE_TTL, store=CACHE_STORE)
+@SemanticCache(embed_text, threshold=SEMANTIC_CACHE_THRESHOLD)
 async def get_details_with_gemini(text_content: str) -> dict | None:
-    """Uses Gemini to extract skills and experience."""
+    """Uses Gemini to extract skills, experience and location."""
     if not text_content:
         return None
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    prompt = f"""
-    Analyze the following text and extract the key details.
-    Return a clean JSON object with "skills" and "experience".
-    - "skills": A comma-separated string of the top 5-7 most important technical skills.
-    - "experience": An integer for total years of experience (default to 3 if not found).
-    Text:
-    ---
-    {text_content}
-    ---
-    """
+    return await gemini_batcher.submit(text_content)
+
+async def extract_details(text_content: str) -> dict | None:
+    """Makes a single Gemini extraction call for one text."""
+    prompt = f"Text:\n---\n{text_content}\n---"
     try:
-        response = await model.generate_content_async(prompt)
-        json_str = response.text.strip().replace("```json", "").replace("```", "").strip()
-        return json.loads(json_str)
-    except Exception as e:
-        print(f"Error calling Gemini API: {e}")
+        response = await GEMINI_MODEL.generate_content_async(prompt)
+        return orjson.loads(response.text)
+    except Exception:
+        logger.exception("Error calling Gemini API")
         return None
 
-async def fetch_candidates_for_skill(details: dict, skill: str) -> list | None:
-    """Makes a single API call for one skill."""
-    params = {
-        "skills": skill,
+async def get_details_with_gemini_batch(texts: list[str]) -> list[dict | None]:
+    """Extracts details for several texts in one Gemini call, falling back to one call each."""
+    if len(texts) == 1:
+        return [await extract_details(texts[0])]
+    # JSON-encoding the texts keeps "---" lines or "Text 2:" inside a text from
+    # blurring the boundaries between items
+    prompt = orjson.dumps([{"id": i, "text": text} for i, text in enumerate(texts)]).decode()
+    try:
+        response = await GEMINI_BATCH_MODEL.generate_content_async(
+            prompt,
+            generation_config={"max_output_tokens": GEMINI_GENERATION_CONFIG["max_output_tokens"] * len(texts)},
+        )
+        results = orjson.loads(response.text)
+        by_id = {item.pop("id"): item for item in results if isinstance(item, dict) and "id" in item}
+        # Every input id must come back exactly once; anything else is retried individually
+        if len(results) == len(texts) and set(by_id) == set(range(len(texts))):
+            return [by_id[i] for i in range(len(texts))]
+        logger.warning("Batched Gemini reply did not match %s texts; retrying one by one", len(texts))
+    except Exception:
+        logger.exception("Error calling Gemini API for a batch of %s", len(texts))
+    return list(await asyncio.gather(*(extract_details(text) for text in texts)))
+
+class GeminiBatcher:
+    """Coalesces concurrent extraction requests into batched Gemini calls."""
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # Strong references so in-flight batch tasks are not garbage-collected
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, text_content: str) -> dict | None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text_content, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        try:
+            results = await get_details_with_gemini_batch([text for text, _ in batch])
+        except Exception:
+            logger.exception("Error extracting a batch of %s", len(batch))
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result if isinstance(result, dict) else None)
+
+gemini_batcher = GeminiBatcher(GEMINI_BATCH_WINDOW, GEMINI_BATCH_SIZE)
+
+def build_candidate_query(details: dict, skills: list[str]) -> dict:
+    """Builds the ATS query parameters for one or more skills."""
+    skills_str = ",".join(skills)
+    return {
+        "skills": skills_str,
         "exp_l": max(0, int(details.get('experience', 3)) - 2),
         "exp_h": int(details.get('experience', 3)) + 2,
-        "location": "bangalore",
+        "location": str(details.get('location') or "any").strip().lower(),
         "job_id": "telegram_search_sub",
         "email_id": "bot@example.com",
-        "job_title": f"Search for {skill}"
+        "job_title": f"Search for {skills_str}"
     }
+
+def candidates_cache_key(details: dict, skills: list[str]) -> str:
+    """Hashes only the query fields that affect which candidates are returned."""
+    params = build_candidate_query(details, skills)
+    query = {field: params[field] for field in ("skills", "exp_l", "exp_h", "location")}
+    return hashlib.sha256(orjson.dumps(query, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+@exact_cache(candidates_cache_key, ttl=ATS_CACHE_TTL, store=CACHE_STORE)
+async def fetch_candidates_for_skills(details: dict, skills: list[str]) -> list | None:
+    """Makes a single API call for the given skills."""
+    params = build_candidate_query(details, skills)
     try:
-        async with httpx.AsyncClient() as client:
-            api_url = f"{ATS_API_BASE_URL}/candidates"
-            response = await client.get(api_url, params=params)
-            response.raise_for_status()
-            return response.json()
+        client = get_http_client()
+        api_url = f"{ATS_API_BASE_URL}/candidates"
+        response = await client.get(api_url, params=params)
+        response.raise_for_status()
+        return orjson.loads(response.content)
     except httpx.RequestError as e:
-        print(f"API call for skill '{skill}' failed: {e}")
+        logger.warning("API call for skills '%s' failed: %s", params['skills'], e)
         return None
 
-async def find_intelligent_matches(details: dict) -> list | None:
-    """Orchestrates multiple API calls and re-ranks the results."""
-    original_skills_str = details.get('skills')
-    if not original_skills_str:
-        return None
+def matches_cache_key(details: dict) -> str:
+    """Hashes the canonical JSON of the extracted details."""
+    return hashlib.blake2b(orjson.dumps(details, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
 
-    skill_list = [s.strip() for s in original_skills_str.split(',')]
-    
-    # Create and run API call tasks concurrently
-    tasks = [fetch_candidates_for_skill(details, skill) for skill in skill_list]
-    results_from_calls = await asyncio.gather(*tasks)
+async def find_intelligent_matches(details: dict) -> dict:
+    """Orchestrates the ATS API calls and re-ranks the results."""
+    if not details.get('skills'):
+        return {"matches": None, "complete": True}
+    return await rank_candidates(details)
+
+# Only rankings built from every ATS query are cached; a timed-out or failed
+# query must not pin a degraded ranking for the whole TTL
+@exact_cache(matches_cache_key, maxsize=512, ttl=ATS_CACHE_TTL, store=CACHE_STORE,
+             cache_if=lambda ranking: ranking["complete"])
+async def rank_candidates(details: dict) -> dict:
+    """Searches the ATS and returns the ranked matches plus whether every query succeeded."""
+    original_skills_str = details['skills']
+
+    # Dedupe near-identical skills such as "Python" / "python " before querying
+    skill_list = list(dict.fromkeys(s.strip().lower() for s in original_skills_str.split(',') if s.strip()))
+
+    if ATS_BATCH_SKILLS:
+        # One request for every skill; the ATS returns the union
+        queries = [skill_list]
+    else:
+        # One request per skill, run concurrently
+        queries = [[skill] for skill in skill_list]
+
+    # Deadline-bound every call so a slow query cannot stall (or a failed one
+    # sink) the whole search
+    tasks = [
+        asyncio.wait_for(fetch_candidates_for_skills(details, query), timeout=ATS_FANOUT_TIMEOUT)
+        for query in queries
+    ]
+    results_from_calls = await asyncio.gather(*tasks, return_exceptions=True)
+    for query, result in zip(queries, results_from_calls):
+        if isinstance(result, Exception):
+            logger.warning("API call for skills '%s' skipped: %r", ",".join(query), result)
+    # fetch_candidates_for_skills returns None for request errors
+    complete = all(isinstance(result, list) for result in results_from_calls)
 
     # Aggregate unique candidates using their email as a key
     all_candidates = {}
     for result_list in results_from_calls:
-        if result_list:
+        if result_list and not isinstance(result_list, Exception):
             for cand in result_list:
                 email = cand.get('email')
                 if email:
-                    all_candidates[email] = cand
+                    # Copy so re-scoring never mutates cached API results
+                    all_candidates[email] = dict(cand)
     
     if not all_candidates:
-        return None
+        return {"matches": None, "complete": complete}
 
     unique_list = list(all_candidates.values())
 
     # Re-score candidates based on the original full list of skills
-    for cand in unique_list:
-        cand['final_match_score'] = local_match_skill(cand.get('skills'), original_skills_str)
+    scores = score_candidates(all_candidates, normalize_skills(original_skills_str))
+    for email, cand in all_candidates.items():
+        cand['final_match_score'] = scores[email]
 
     # Sort by the new, more accurate score in descending order
-    return sorted(unique_list, key=lambda x: x.get('final_match_score', 0), reverse=True)
+    matches = sorted(unique_list, key=lambda x: x.get('final_match_score', 0), reverse=True)
+    return {"matches": matches, "complete": complete}
+
+@functools.lru_cache(maxsize=1024)
+def render_candidate_card(name: str, email: str, location: str, experience: str, score: str, filename: str | None) -> str:
+    """Renders one candidate card; repeat top-5 candidates reuse the cached string."""
+    card = CANDIDATE_CARD_TEMPLATE.format(
+        name=html.escape(name),
+        email=html.escape(email),
+        location=html.escape(location),
+        experience=html.escape(experience),
+        score=html.escape(score),
+    )
+    if filename and filename != 'N/A':
+        resume_url = f"{ATS_API_BASE_URL}/download-resume/{urllib.parse.quote(filename)}"
+        card += RESUME_LINK_TEMPLATE.format(url=html.escape(resume_url))
+    return card
+
+def format_candidate_card(cand: dict) -> str:
+    """Formats a candidate's reply card from their ATS record."""
+    filename = cand.get('filenames')
+    return render_candidate_card(
+        str(cand.get('name', 'N/A')),
+        str(cand.get('email', 'N/A')),
+        str(cand.get('location', 'N/A')),
+        str(cand.get('experience', 'N/A')),
+        # Use the new, more accurate score
+        str(cand.get('final_match_score', 'N/A')),
+        str(filename) if filename else None,
+    )
+
+def pack_messages(blocks: list[str], separator: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Joins blocks into as few messages as fit under Telegram's length cap."""
+    messages, current = [], ""
+    for block in blocks:
+        joined = f"{current}{separator}{block}" if current else block
+        if current and len(joined) > limit:
+            messages.append(current)
+            current = block
+        else:
+            current = joined
+    if current:
+        messages.append(current)
+    return messages
+
+async def pipeline_worker() -> None:
+    """Takes one queued job at a time and runs it to completion."""
+    while True:
+        job = await _pipeline_queue.get()
+        try:
+            await process_and_reply(*job)
+        except Exception:
+            logger.exception("Error processing update")
+        finally:
+            _pipeline_queue.task_done()
+
+async def start_pipeline_workers() -> None:
+    """Creates the job queue and starts the worker pool."""
+    global _pipeline_queue
+    _pipeline_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    _pipeline_workers.extend(asyncio.create_task(pipeline_worker()) for _ in range(PIPELINE_WORKERS))
+
+async def stop_pipeline_workers() -> None:
+    """Lets queued and running jobs finish, then cancels the worker pool."""
+    try:
+        await asyncio.wait_for(_pipeline_queue.join(), timeout=PIPELINE_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Shutdown drain timed out with %s jobs still queued", _pipeline_queue.qsize())
+    for task in _pipeline_workers:
+        task.cancel()
+    await asyncio.gather(*_pipeline_workers, return_exceptions=True)
+    _pipeline_workers.clear()
+
+async def on_startup(application: Application) -> None:
+    """Opens shared resources once the application is initialized."""
+    await open_http_client(application)
+    await start_pipeline_workers()
+
+async def on_shutdown(application: Application) -> None:
+    """Releases shared resources on shutdown."""
+    await stop_pipeline_workers()
+    await close_http_client(application)
 
 # --- Telegram Bot Handlers ---
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stops re-delivered updates (Telegram retries) before any real handler runs."""
+    if update.update_id in _seen_update_ids:
+        raise ApplicationHandlerStop
+    _seen_update_ids[update.update_id] = None
+    if len(_seen_update_ids) > SEEN_UPDATES_MAX:
+        _seen_update_ids.popitem(last=False)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message."""
     if update.message:
         await update.message.reply_text(
             "👋 Welcome to the ATS Candidate Search Bot!\n\n"
             "You can either:\n"
-            "1. **Upload a resume file** (PDF or DOCX).\n"
-            "2. **Paste the text** of a job description.\n\n"
-            "I will analyze the content and find the most relevant candidates."
+            "1. <b>Upload a resume file</b> (PDF or DOCX).\n"
+            "2. <b>Paste the text</b> of a job description.\n\n"
+            "I will analyze the content and find the most relevant candidates.",
+            parse_mode=ParseMode.HTML,
         )
 
 async def process_and_reply(text_content: str, update: Update, processing_message) -> None:
@@ -154,70 +605,124 @@ async def process_and_reply(text_content: str, update: Update, processing_messag
         return
 
     extracted_info = (
-        f"🔍 **Extracted Details:**\n"
-        f"  - **Skills:** {details.get('skills')}\n"
-        f"  - **Experience:** {details.get('experience')} years\n\n"
+        f"🔍 <b>Extracted Details:</b>\n"
+        f"  - <b>Skills:</b> {html.escape(str(details.get('skills')))}\n"
+        f"  - <b>Experience:</b> {html.escape(str(details.get('experience')))} years\n"
+        f"  - <b>Location:</b> {html.escape(str(details.get('location', 'any')))}\n\n"
         "Searching for the best matches..."
     )
-    await processing_message.edit_text(extracted_info, parse_mode='Markdown')
-
-    # Use the new intelligent search function
-    similar_candidates = await find_intelligent_matches(details)
+    # Run the intelligent search while the status edit is in flight
+    _, ranking = await asyncio.gather(
+        processing_message.edit_text(extracted_info, parse_mode=ParseMode.HTML),
+        find_intelligent_matches(details),
+    )
+    similar_candidates = ranking["matches"]
 
+    # No results because the ATS queries failed is not the same as no matches
+    if not similar_candidates and not ranking["complete"]:
+        await processing_message.edit_text("The candidate search failed. Please try again in a moment.")
+        return
     if not similar_candidates:
         await processing_message.edit_text("Could not find any matching candidates in the database.")
         return
 
-    await processing_message.edit_text(f"✅ Found {len(similar_candidates)} relevant candidates. Here are the top 5:")
-    
-    for cand in similar_candidates[:5]:
-        message_parts = [
-            f"👤 **Name:** {cand.get('name', 'N/A')}",
-            f"📧 **Email:** {cand.get('email', 'N/A')}",
-            f"📍 **Location:** {cand.get('location', 'N/A')}",
-            f"💼 **Experience:** {cand.get('experience', 'N/A')} years",
-            # Use the new, more accurate score
-            f"✨ **Match Score:** {cand.get('final_match_score', 'N/A')}"
-        ]
-        filename = cand.get('filenames')
-        if filename and filename != 'N/A':
-            resume_url = f"{ATS_API_BASE_URL}/download-resume/{filename}"
-            message_parts.append(f"📄 [Download Resume]({resume_url})")
-            
-        message = "\n".join(message_parts)
-        await update.message.reply_text(message, parse_mode='Markdown')
+    cards = [format_candidate_card(cand) for cand in similar_candidates[:5]]
+
+    async def send_cards() -> None:
+        # One reply for all candidates instead of one round-trip each; any
+        # overflow chunks are sent in order
+        for message in pack_messages(cards, CANDIDATE_SEPARATOR):
+            await update.message.reply_text(message, parse_mode=ParseMode.HTML)
+
+    # The status edit and the new reply are independent requests; send them together
+    await asyncio.gather(
+        processing_message.edit_text(f"✅ Found {len(similar_candidates)} relevant candidates. Here are the top 5:"),
+        send_cards(),
+    )
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles document uploads (resumes)."""
     if not update.message or not update.message.document: return
     document = update.message.document
-    if not document.file_name or not document.file_name.lower().endswith(('.pdf', '.docx')):
+    # Reject from the message metadata alone, before downloading anything
+    if (
+        not document.file_name
+        or not document.file_name.lower().endswith(ALLOWED_EXTENSIONS)
+        or (document.mime_type and document.mime_type not in ALLOWED_MIME_TYPES)
+    ):
         await update.message.reply_text("Unsupported file type. Please upload a PDF or DOCX file.")
         return
+    if document.file_size and document.file_size > MAX_UPLOAD_BYTES:
+        await update.message.reply_text(
+            f"File is too large. Please upload a file under {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+        )
+        return
     processing_message = await update.message.reply_text(f"📄 Processing '{document.file_name}'...")
     file = await context.bot.get_file(document.file_id)
-    file_content = await file.download_as_bytearray()
-    text_content = extract_text_from_file(document.file_name, bytes(file_content))
+    # Download straight into a spooled file (spills to disk for large uploads)
+    # instead of a bytearray that then gets copied again
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as file_obj:
+        await file.download_to_memory(file_obj)
+        file_obj.seek(0)
+        # Parsing is CPU-bound; keep the event loop free for other updates (PDFium
+        # parses are serialized inside extract_text_from_file)
+        text_content = await asyncio.to_thread(extract_text_from_file, document.file_name, file_obj)
     if not text_content:
         await processing_message.edit_text("Could not extract text from the file.")
         return
-    await process_and_reply(text_content, update, processing_message)
+    # Queue the slow Gemini + ATS pipeline for the bounded worker pool; this
+    # waits only if the queue is full (backpressure)
+    await _pipeline_queue.put((text_content, update, processing_message))
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles plain text messages (job descriptions)."""
     if not update.message or not update.message.text: return
     text_content = update.message.text
     processing_message = await update.message.reply_text("✍️ Processing job description...")
-    await process_and_reply(text_content, update, processing_message)
+    # Queue the slow Gemini + ATS pipeline for the bounded worker pool; this
+    # waits only if the queue is full (backpressure)
+    await _pipeline_queue.put((text_content, update, processing_message))
+
+# Handler filters, built once
+DOCUMENT_FILTER = filters.Document.ALL
+TEXT_FILTER = filters.TEXT & ~filters.COMMAND
 
 def main() -> None:
     """Start the bot."""
-    print("Starting ATS Candidate Search Bot...")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-    application.run_polling()
+    log_listener = configure_logging()
+    logger.info("Starting ATS Candidate Search Bot...")
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Keep-alive pool sized for concurrent replies and file downloads
+        .request(OrjsonHTTPXRequest(connection_pool_size=TELEGRAM_POOL_SIZE, http_version="1.1"))
+        .get_updates_request(OrjsonHTTPXRequest())
+        # Paces outgoing calls under Telegram's global and per-chat flood limits
+        .rate_limiter(AIORateLimiter())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    # Runs first (group -1) and blocks so duplicates never reach the handlers below
+    application.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
+    # block=False lets PTB dispatch updates from different users concurrently
+    application.add_handler(CommandHandler("start", start, block=False))
+    application.add_handler(MessageHandler(DOCUMENT_FILTER, handle_document, block=False))
+    application.add_handler(MessageHandler(TEXT_FILTER, handle_text_message, block=False))
+    try:
+        if TELEGRAM_WEBHOOK_URL:
+            # Telegram pushes updates to us; no idle getUpdates long-polling
+            application.run_webhook(
+                listen="0.0.0.0",
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{TELEGRAM_WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+            )
+        else:
+            application.run_polling()
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,267 @@
+import asyncio
+import functools
+import logging
+import math
+import operator
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import OrderedDict
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """NFC-normalizes text and collapses runs of whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class SemanticCache:
+    """Serves cached results for inputs whose embeddings are near-duplicates.
+
+    Every call pays one `embed` round trip before the wrapped function runs,
+    so this only pays off when `embed` is much cheaper than the function
+    itself (an embedding call versus an LLM generation). The similarity scan
+    is pure Python, O(entries x dims), and runs in a worker thread so it does
+    not stall the event loop.
+    """
+
+    def __init__(self, embed, threshold: float = 0.95, maxsize: int = 512):
+        self._embed = embed
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # int8 codes and their dequantization scales, one per cached entry
+        self._codes: list[array] = []
+        self._scales: list[float] = []
+        self._values: list = []
+
+    async def _embed_unit(self, text: str) -> list[float] | None:
+        """Embeds the normalized text and scales it to unit length."""
+        vector = await self._embed(normalize_text(text))
+        if not vector:
+            return None
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else None
+
+    @staticmethod
+    def _quantize(vector: list[float]) -> tuple[array, float]:
+        """Scalar-quantizes a vector to int8 codes plus the scale that maps them back."""
+        scale = 127 / (max(map(abs, vector)) or 1.0)
+        return array("b", (round(x * scale) for x in vector)), scale
+
+    async def lookup(self, vector: list[float]):
+        """Returns the cached value closest to `vector` if it clears the threshold."""
+        # Snapshot the entries so add() on the event loop cannot shift them mid-scan
+        entries = list(zip(self._codes, self._scales, self._values))
+        return await asyncio.to_thread(self._scan, vector, entries)
+
+    def _scan(self, vector: list[float], entries: list[tuple[array, float, object]]):
+        best_score, best_value = -1.0, None
+        for codes, scale, value in entries:
+            # Only the stored side is quantized; the query keeps full precision
+            score = sum(map(operator.mul, vector, codes)) / scale
+            if score > best_score:
+                best_score, best_value = score, value
+        return best_value if best_score >= self.threshold else None
+
+    def add(self, vector: list[float], value) -> None:
+        """Stores a value, evicting the oldest entry once the cache is full."""
+        codes, scale = self._quantize(vector)
+        self._codes.append(codes)
+        self._scales.append(scale)
+        self._values.append(value)
+        if len(self._values) > self.maxsize:
+            del self._codes[0], self._scales[0], self._values[0]
+
+    def __call__(self, func):
+        """Wraps an async single-text function with the semantic lookup."""
+        @functools.wraps(func)
+        async def wrapper(text: str):
+            if not text:
+                return await func(text)
+            vector = await self._embed_unit(text)
+            if vector is None:
+                return await func(text)
+            cached = await self.lookup(vector)
+            if cached is not None:
+                return cached
+            result = await func(text)
+            if result is not None:
+                self.add(vector, result)
+            return result
+        return wrapper
+
+
+class MemoryStore:
+    """In-process LRU store with a per-entry time-to-live."""
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+def _pack(value) -> bytes:
+    return zlib.compress(orjson.dumps(value))
+
+
+def _unpack(blob: bytes):
+    return orjson.loads(zlib.decompress(blob))
+
+
+class SQLiteStore:
+    """SQLite-backed LRU store shared by every process using the same file."""
+
+    def __init__(self, path: str, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB, expires_at REAL, last_used REAL)"
+        )
+
+    def _get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+        return _unpack(row[0])
+
+    def _set(self, key: str, blob: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, blob, now + ttl, now)
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if count > self.maxsize:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY last_used LIMIT ?)",
+                    (count - self.maxsize,),
+                )
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, _pack(value), ttl)
+
+
+class RedisStore:
+    """Redis-backed store: native key expiry plus a sorted set for LRU eviction."""
+
+    LRU_KEY = "cache:lru"
+
+    def __init__(self, url: str, maxsize: int = 10_000):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package.") from e
+        self.maxsize = maxsize
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str):
+        blob = await self._redis.get(key)
+        if blob is None:
+            return None
+        await self._redis.zadd(self.LRU_KEY, {key: time.time()})
+        return _unpack(blob)
+
+    async def set(self, key: str, value, ttl: float) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, _pack(value), ex=max(1, int(ttl)))
+            pipe.zadd(self.LRU_KEY, {key: time.time()})
+            pipe.zcard(self.LRU_KEY)
+            *_, count = await pipe.execute()
+        if count > self.maxsize:
+            stale = await self._redis.zrange(self.LRU_KEY, 0, count - self.maxsize - 1)
+            if stale:
+                await self._redis.delete(*stale)
+                await self._redis.zrem(self.LRU_KEY, *stale)
+
+
+def exact_cache(key_func, maxsize: int = 10_000, ttl: float = 3600.0, store=None, cache_if=None):
+    """Caches an async function by `key_func(*args)`, coalescing concurrent misses.
+
+    Entries live in `store` (shared across functions, namespaced by function
+    name) or, by default, in a private in-process `MemoryStore` bounded by
+    `maxsize`; a supplied store keeps its own bound and `maxsize` is unused.
+    `None` results are treated as failures and are never stored, nor are
+    results for which `cache_if(result)` is false. Store errors are logged
+    and handled as a miss (get) or skipped (set), so an unavailable backend
+    only costs cache hits.
+    """
+    def decorator(func):
+        cache_store = store or MemoryStore(maxsize)
+        # key -> [lock, number of callers currently holding or awaiting it]
+        locks: dict[str, list] = {}
+
+        async def cache_get(key: str):
+            try:
+                return await cache_store.get(key)
+            except Exception:
+                logger.exception("Cache read failed for %s", key)
+                return None
+
+        async def cache_set(key: str, value) -> None:
+            try:
+                await cache_store.set(key, value, ttl)
+            except Exception:
+                logger.exception("Cache write failed for %s", key)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = f"{func.__name__}:{key_func(*args, **kwargs)}"
+            cached = await cache_get(key)
+            if cached is not None:
+                return cached
+            entry = locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    cached = await cache_get(key)
+                    if cached is not None:
+                        return cached
+                    result = await func(*args, **kwargs)
+                    if result is not None and (cache_if is None or cache_if(result)):
+                        await cache_set(key, result)
+                    return result
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del locks[key]
+
+        wrapper.cache = cache_store
+        return wrapper
+    return decorator
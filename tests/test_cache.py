@@ -0,0 +1,134 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from cache import MemoryStore, SQLiteStore, exact_cache
+
+
+class FailingStore:
+    """Store whose every operation raises, like an unreachable backend."""
+
+    async def get(self, key):
+        raise ConnectionError("store unavailable")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("store unavailable")
+
+
+class ExactCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_misses_share_one_call(self):
+        calls = 0
+
+        @exact_cache(lambda x: x)
+        async def double(x):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return x * 2
+
+        results = await asyncio.gather(*(double(3) for _ in range(10)))
+        self.assertEqual(results, [6] * 10)
+        self.assertEqual(calls, 1)
+        self.assertEqual(await double(3), 6)
+        self.assertEqual(calls, 1)
+
+    async def test_cancelled_holder_releases_lock(self):
+        started = asyncio.Event()
+        calls = 0
+
+        @exact_cache(lambda x: x)
+        async def slow(x):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                started.set()
+                await asyncio.sleep(10)
+            return x
+
+        holder = asyncio.create_task(slow(1))
+        await started.wait()
+        waiter = asyncio.create_task(slow(1))
+        await asyncio.sleep(0)
+        holder.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await holder
+        # The waiter takes over the lock and computes the value itself
+        self.assertEqual(await asyncio.wait_for(waiter, timeout=1), 1)
+        self.assertEqual(calls, 2)
+
+    async def test_none_and_rejected_results_are_not_cached(self):
+        calls = 0
+
+        @exact_cache(lambda x: x, cache_if=lambda result: result["complete"])
+        async def rank(x):
+            nonlocal calls
+            calls += 1
+            return None if x == "none" else {"complete": False}
+
+        await rank("none")
+        await rank("none")
+        await rank("partial")
+        await rank("partial")
+        self.assertEqual(calls, 4)
+
+    async def test_store_errors_fall_back_to_calling_through(self):
+        @exact_cache(lambda x: x, store=FailingStore())
+        async def identity(x):
+            return x
+
+        with self.assertLogs("cache", level="ERROR"):
+            self.assertEqual(await identity(5), 5)
+
+
+class MemoryStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_evicts_least_recently_used(self):
+        store = MemoryStore(maxsize=2)
+        await store.set("a", 1, ttl=60)
+        await store.set("b", 2, ttl=60)
+        await store.get("a")
+        await store.set("c", 3, ttl=60)
+        self.assertEqual(await store.get("a"), 1)
+        self.assertIsNone(await store.get("b"))
+
+    async def test_expired_entries_are_misses(self):
+        store = MemoryStore()
+        await store.set("a", 1, ttl=-1)
+        self.assertIsNone(await store.get("a"))
+
+
+class SQLiteStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    async def test_round_trip_and_expiry(self):
+        store = SQLiteStore(self.path)
+        await store.set("a", {"skills": ["python"]}, ttl=60)
+        await store.set("b", [1, 2], ttl=-1)
+        self.assertEqual(await store.get("a"), {"skills": ["python"]})
+        self.assertIsNone(await store.get("b"))
+
+    async def test_evicts_least_recently_used(self):
+        store = SQLiteStore(self.path, maxsize=2)
+        await store.set("a", 1, ttl=60)
+        await asyncio.sleep(0.01)
+        await store.set("b", 2, ttl=60)
+        await asyncio.sleep(0.01)
+        await store.get("a")
+        await asyncio.sleep(0.01)
+        await store.set("c", 3, ttl=60)
+        self.assertEqual(await store.get("a"), 1)
+        self.assertIsNone(await store.get("b"))
+        self.assertEqual(await store.get("c"), 3)
+
+    async def test_entries_are_shared_across_connections(self):
+        await SQLiteStore(self.path).set("a", 1, ttl=60)
+        self.assertEqual(await SQLiteStore(self.path).get("a"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()